@@ -0,0 +1,188 @@
+# cython: boundscheck=False, wraparound=False, cdivision=True
+
+"""
+Compiled propagation and guess-n-check for sudoku.py.
+
+Build in place with:  cythonize -i _sudoku_c.pyx
+
+Works on a writable buffer of 81 unsigned 16-bit cell bitmasks (such as
+Sudoku.cells), where bit d-1 represents digit d and a cell with a single
+value is considered solved.
+"""
+
+cdef extern from *:
+    int __builtin_popcount(unsigned int x) nogil
+    int __builtin_ctz(unsigned int x) nogil
+
+
+#############
+# Constants #
+#############
+
+cdef enum:
+    DIGITS = 0x1FF
+
+# Squares are indexed 0..80 in row-major order.
+cdef unsigned char PEERS[81][20]
+cdef unsigned char UNITS[27][9]
+
+
+cdef void _build_tables():
+    """Fill in UNITS (columns, rows, then boxes) and PEERS."""
+    cdef int s, t, i, n
+
+    for i in range(9):
+        for t in range(9):
+            UNITS[i][t] = t * 9 + i
+            UNITS[9 + i][t] = i * 9 + t
+            UNITS[18 + i][t] = ((i // 3 * 3 + t // 3) * 9 +
+                                i % 3 * 3 + t % 3)
+
+    for s in range(81):
+        n = 0
+        for t in range(81):
+            if t != s and (t // 9 == s // 9 or t % 9 == s % 9 or
+                           (t // 27 == s // 27 and t % 9 // 3 == s % 9 // 3)):
+                PEERS[s][n] = t
+                n += 1
+
+_build_tables()
+
+
+#############
+# Functions #
+#############
+
+cdef bint propagate(unsigned short *cells) nogil:
+    """
+    Eliminate solved values from their peers and fill in hidden singletons
+    until nothing changes.  Returns False on a contradiction.
+    """
+    cdef unsigned char worklist[81]
+    cdef int head = 0, tail = 0
+    cdef int s, i, peer, u
+    cdef unsigned short value, cell, once, twice, singles
+
+    # Start with every square which is already solved.
+    for s in range(81):
+        if cells[s] == 0:
+            return False
+        if __builtin_popcount(cells[s]) == 1:
+            worklist[tail] = s
+            tail += 1
+
+    while True:
+
+        # Remove each solved value from its peers; a peer that's left with a
+        # single value goes on the worklist.  Every square is solved (and
+        # queued) at most once.
+        while head < tail:
+            s = worklist[head]
+            head += 1
+            value = cells[s]
+            for i in range(20):
+                peer = PEERS[s][i]
+                cell = cells[peer]
+                if cell & value:
+                    cell &= ~value
+                    if cell == 0:
+                        return False
+                    cells[peer] = cell
+                    if __builtin_popcount(cell) == 1:
+                        worklist[tail] = peer
+                        tail += 1
+
+        # Count all 9 values in each unit at once, one bit lane per value,
+        # looking for values which only fit in one square.
+        for u in range(27):
+            once = twice = 0
+            for i in range(9):
+                cell = cells[UNITS[u][i]]
+                twice |= once & cell
+                once |= cell
+            if once != DIGITS:
+                return False
+
+            singles = once & ~twice
+            if not singles:
+                continue
+            for i in range(9):
+                s = UNITS[u][i]
+                value = cells[s] & singles
+                if value and value != cells[s]:
+                    if __builtin_popcount(value) != 1:
+                        return False
+                    cells[s] = value
+                    worklist[tail] = s
+                    tail += 1
+
+        if head == tail:
+            return True
+
+
+cdef bint search(unsigned short *cells) nogil:
+    """
+    Solve cells in place with propagation and guess-n-check, learning from
+    each failed guess.  Returns whether a solution was found.
+    """
+    # Each level of guessing keeps a snapshot of the cells from before the
+    # guess, the square guessed on, and the value guessed.
+    cdef unsigned short snapshots[81][81]
+    cdef int squares[81]
+    cdef unsigned short guesses[81]
+    cdef int depth = 0
+    cdef int s, square, count, fewest
+    cdef bint ok
+
+    ok = propagate(cells)
+    while True:
+        if ok:
+            # Guess on the non-determined square with the fewest values.
+            square = -1
+            fewest = 10
+            for s in range(81):
+                count = __builtin_popcount(cells[s])
+                if 1 < count < fewest:
+                    square = s
+                    fewest = count
+                    if count == 2:
+                        break
+            if square < 0:
+                return True
+
+            # Guess its lowest value.
+            for s in range(81):
+                snapshots[depth][s] = cells[s]
+            squares[depth] = square
+            guesses[depth] = 1 << __builtin_ctz(cells[square])
+            cells[square] = guesses[depth]
+            depth += 1
+
+            ok = propagate(cells)
+            continue
+
+        # The last guess led to a contradiction, so it's wrong.  Go back to
+        # before it, remove the value, and see what else that tells us.  If
+        # that's a contradiction too, the guess before it was wrong.
+        if depth == 0:
+            return False
+        depth -= 1
+        for s in range(81):
+            cells[s] = snapshots[depth][s]
+        cells[squares[depth]] &= ~guesses[depth]
+        ok = propagate(cells)
+
+
+def solve(unsigned short[::1] cells not None):
+    """
+    Solve a buffer of 81 cell bitmasks in place.
+    Returns whether a solution was found.
+    """
+    cdef bint result
+
+    if cells.shape[0] != 81:
+        raise ValueError("Expected 81 cells, got %d." % cells.shape[0])
+
+    with nogil:
+        result = search(&cells[0])
+    return result
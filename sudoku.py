@@ -6,22 +6,231 @@
 # Imports #
 ###########
 
-import copy
-import re
+from __future__ import print_function
+
+import array
+
+from collections import deque
 
 try:
-    from itertools import combinations
+    from _sudoku_c import solve as _c_solve
 except ImportError:
-    from permutations import combinations
+    _c_solve = None
+
+try:
+    import numpy
+    from numba import njit
+except ImportError:
+    numpy = njit = None
 
 
 #############
 # Functions #
 #############
 
-def cross(ms, ns):
-    """Returns a basic cross product matrix of two iters."""
-    return [m + n for m in ms for n in ns]
+def row_of(square):
+    """Returns the row (0..8) of a square index."""
+    return square // 9
+
+
+def col_of(square):
+    """Returns the column (0..8) of a square index."""
+    return square % 9
+
+
+def box_of(square):
+    """Returns the box (0..8, in row-major order) of a square index."""
+    return row_of(square) // 3 * 3 + col_of(square) // 3
+
+
+def popcount(mask):
+    """Returns the number of digits set in a cell's (9-bit) bitmask."""
+    return _POPCOUNTS[mask]
+
+
+def bits(mask):
+    """Yields each single-digit bitmask set in a cell's bitmask."""
+    while mask:
+        bit = mask & -mask
+        yield bit
+        mask ^= bit
+
+
+def squares_of(board):
+    """Yields the index of each square set in an 81-bit board bitmask."""
+    for bit in bits(board):
+        yield bit.bit_length() - 1
+
+
+def mask_to_str(mask):
+    """Returns the digits of a cell's bitmask as a sorted string."""
+    return ''.join(str(d + 1) for d in range(9) if mask & (1 << d))
+
+
+#############
+# Constants #
+#############
+
+# Squares are indexed 0..80 in row-major order.
+_SQUARES = tuple(range(81))
+
+# The number of bits set in every 9-bit mask.
+_POPCOUNTS = tuple(bin(m).count('1') for m in range(1 << 9))
+
+# The sorted digits string of every 9-bit mask.
+_MASK_STRS = tuple(mask_to_str(m) for m in range(1 << 9))
+
+# Create tuples of frozensets for all columns, rows, and boxes.
+_COL_LIST = tuple(frozenset(s for s in _SQUARES if col_of(s) == c)
+                  for c in range(9))
+_ROW_LIST = tuple(frozenset(s for s in _SQUARES if row_of(s) == r)
+                  for r in range(9))
+_BOX_LIST = tuple(frozenset(s for s in _SQUARES if box_of(s) == b)
+                  for b in range(9))
+
+# It's useful to have a tuple of all unit sets.
+_UNIT_LIST = _COL_LIST + _ROW_LIST + _BOX_LIST
+
+# Each box crossed with each row or column through it, as a tuple of the
+# squares they share, the rest of the box, and the rest of the row or column.
+_INTERSECTIONS = tuple(
+    (tuple(box & line), tuple(box - line), tuple(line - box))
+    for box in _BOX_LIST for line in _ROW_LIST + _COL_LIST if box & line)
+
+# The indexes (into _UNIT_LIST) of all units for each square.
+_UNITS = tuple(tuple(u for u, unit in enumerate(_UNIT_LIST) if s in unit)
+               for s in _SQUARES)
+
+# A frozenset of all peers for each square.
+_PEERS = tuple(frozenset(s2 for u in _UNITS[s]
+                            for s2 in _UNIT_LIST[u] if s2 != s)
+               for s in _SQUARES)
+
+# The same peers, as a tuple of square indexes, for fast iteration.
+_PEERS_LIST = tuple(tuple(sorted(peers)) for peers in _PEERS)
+
+# The units and peers again, as 81-bit board bitmasks (bit s for square s).
+_UNIT_MASKS = tuple(sum(1 << s for s in unit) for unit in _UNIT_LIST)
+_PEER_MASKS = tuple(sum(1 << s for s in peers) for peers in _PEERS)
+
+# As an exact cover problem, each square/value pair (indexed square * 9 +
+# digit) covers 4 columns: the square itself, and the value within each of
+# the square's units.
+_COVER_COLUMN_COUNT = len(_SQUARES) + len(_UNIT_LIST) * 9
+_COVER_COLUMNS = tuple((s,) + tuple(len(_SQUARES) + u * 9 + d
+                                    for u in _UNITS[s])
+                       for s in _SQUARES for d in range(9))
+
+
+#################
+# Numba kernels #
+#################
+
+# These work on a numpy uint16 array of 81 cell bitmasks, where a cell with a
+# single value is considered solved.  They're only compiled, and only used,
+# when numba is available.
+
+def _propagate(cells, peers, units):
+    """
+    Eliminate solved values from their peers and fill in hidden singletons
+    until nothing changes.  Returns False on a contradiction.
+    """
+    changed = True
+    while changed:
+        changed = False
+
+        # Remove every solved value from its peers.
+        for square in range(81):
+            cell = cells[square]
+            if cell == 0:
+                return False
+            if cell & (cell - 1) == 0:
+                for peer in peers[square]:
+                    if cells[peer] & cell:
+                        cells[peer] &= ~cell
+                        if cells[peer] == 0:
+                            return False
+                        changed = True
+
+        # Look for values which only fit in one square of a unit.
+        for unit in units:
+            for digit in range(9):
+                bit = 1 << digit
+                count = 0
+                last = 0
+                for square in unit:
+                    if cells[square] & bit:
+                        count += 1
+                        last = square
+                if count == 0:
+                    return False
+                if count == 1 and cells[last] != bit:
+                    cells[last] = bit
+                    changed = True
+
+    return True
+
+
+def _solve(cells, peers, units, popcounts):
+    """
+    Solve cells in place with constraint propagation and guess-n-check.
+    Returns whether a solution was found.
+    """
+    # Each level of guessing keeps a snapshot of the cells from before the
+    # guess, the square guessed on, and the value guessed.
+    snapshots = numpy.empty((81, 81), dtype=numpy.uint16)
+    squares = numpy.empty(81, dtype=numpy.int32)
+    guesses = numpy.empty(81, dtype=numpy.uint16)
+    depth = 0
+
+    ok = _propagate(cells, peers, units)
+    while True:
+        if ok:
+            # Guess on the non-determined square with the fewest values.
+            square = -1
+            fewest = 10
+            for s in range(81):
+                count = popcounts[cells[s]]
+                if 1 < count < fewest:
+                    square = s
+                    fewest = count
+                    if count == 2:
+                        break
+            if square < 0:
+                return True
+
+            # Guess its lowest value.
+            cell = cells[square]
+            snapshots[depth] = cells
+            squares[depth] = square
+            guesses[depth] = cell & ~(cell - 1)
+            depth += 1
+
+            cells[square] = guesses[depth - 1]
+            ok = _propagate(cells, peers, units)
+            continue
+
+        # The last guess led to a contradiction, so it's wrong.  Go back to
+        # before it, remove the value, and see what else that tells us.  If
+        # that's a contradiction too, the guess before it was wrong.
+        if depth == 0:
+            return False
+        depth -= 1
+        cells[:] = snapshots[depth]
+        cells[squares[depth]] &= ~guesses[depth]
+        ok = _propagate(cells, peers, units)
+
+
+if njit is None:
+    _solve = None
+else:
+    _propagate = njit(cache=True)(_propagate)
+    _solve = njit(cache=True)(_solve)
+
+    _PEERS_ARR = numpy.array(_PEERS_LIST, dtype=numpy.int32)
+    _UNITS_ARR = numpy.array([sorted(u) for u in _UNIT_LIST],
+                             dtype=numpy.int32)
+    _POPCOUNTS_ARR = numpy.array(_POPCOUNTS, dtype=numpy.int32)
 
 
 ###########
@@ -33,52 +242,182 @@ class InvalidCellValue(ValueError):
     pass
 
 
-class Sudoku(object):
-    """A class representing a sudoku object."""
+class DancingLinks(object):
+    """
+    Knuth's Algorithm X on a dancing links exact cover matrix.  Nodes are
+    indexes into parallel lists of links; node 0 is the root, and nodes
+    1..columns are the column headers.
+    """
+
+    def __init__(self, columns):
+        """Constructor for DancingLinks.  Accepts the number of columns."""
+        headers = range(columns + 1)
+
+        # Link the root and column headers into a circular row.
+        self.left = [h - 1 for h in headers]
+        self.right = [h + 1 for h in headers]
+        self.left[0], self.right[columns] = columns, 0
+
+        # Every column starts out empty.
+        self.up = list(headers)
+        self.down = list(headers)
+        self.column = list(headers)
+        self.size = [0] * len(headers)
+
+        # The row each node belongs to.
+        self.row = [None] * len(headers)
+
+    def add_row(self, row, columns):
+        """Add a row, covering the given columns.  Returns its first node."""
+        first = len(self.column)
+        for c in columns:
+            node = len(self.column)
+            header = c + 1
+
+            # Link the node in at the bottom of its column.
+            self.column.append(header)
+            self.row.append(row)
+            self.up.append(self.up[header])
+            self.down.append(header)
+            self.down[self.up[header]] = node
+            self.up[header] = node
+            self.size[header] += 1
+
+            # Link the node in at the end of the row.
+            self.left.append(self.left[first] if node != first else node)
+            self.right.append(first)
+            self.right[self.left[node]] = node
+            self.left[first] = node
+
+        return first
+
+    def cover(self, header):
+        """Remove a column, and every row in it, from the matrix."""
+        left, right, up, down = self.left, self.right, self.up, self.down
+        column, size = self.column, self.size
+
+        right[left[header]] = right[header]
+        left[right[header]] = left[header]
+
+        i = down[header]
+        while i != header:
+            j = right[i]
+            while j != i:
+                down[up[j]] = down[j]
+                up[down[j]] = up[j]
+                size[column[j]] -= 1
+                j = right[j]
+            i = down[i]
+
+    def uncover(self, header):
+        """Put back a column removed by cover, in reverse order."""
+        left, right, up, down = self.left, self.right, self.up, self.down
+        column, size = self.column, self.size
+
+        i = up[header]
+        while i != header:
+            j = left[i]
+            while j != i:
+                size[column[j]] += 1
+                down[up[j]] = j
+                up[down[j]] = j
+                j = left[j]
+            i = up[i]
+
+        right[left[header]] = header
+        left[right[header]] = header
+
+    def select(self, node):
+        """Commit to a node's row by covering all of its columns."""
+        j = node
+        while True:
+            self.cover(self.column[j])
+            j = self.right[j]
+            if j == node:
+                break
+
+    def search(self, solution):
+        """
+        Extend solution (a list of rows) until every column is covered.
+        Returns whether an exact cover was found.
+        """
+        right, left, down = self.right, self.left, self.down
+        column, size = self.column, self.size
 
-    digits = frozenset([1, 2, 3, 4, 5, 6, 7, 8, 9])
-    valid_chars = frozenset('0.-') | frozenset(map(str, digits))
+        if right[0] == 0:
+            return True
+
+        # Branch on the column with the fewest rows.
+        header = min(self._headers(), key=size.__getitem__)
+        self.cover(header)
+
+        r = down[header]
+        while r != header:
+            solution.append(self.row[r])
+            j = right[r]
+            while j != r:
+                self.cover(column[j])
+                j = right[j]
 
-    rows = cols = 'ABCDEFGHI'
+            if self.search(solution):
+                return True
+
+            j = left[r]
+            while j != r:
+                self.uncover(column[j])
+                j = left[j]
+            solution.pop()
+            r = down[r]
 
-    row_triplets = (rows[:3], rows[3:6], rows[6:])
-    col_triplets = (cols[:3], cols[3:6], cols[6:])
+        self.uncover(header)
+        return False
 
-    last_row_in_box = (rows[2], rows[5])
-    last_col_in_box = (cols[2], cols[5])
+    def _headers(self):
+        """Yields each column header still in the matrix."""
+        h = self.right[0]
+        while h:
+            yield h
+            h = self.right[h]
 
-    squares = frozenset(cross(rows, cols))
+
+class Sudoku(object):
+    """A class representing a sudoku object."""
+
+    # Each cell is a bitmask of candidates: bit d-1 represents digit d.
+    digits = 0x1FF
+
+    # The cell bitmask for each valid character; 0 means an empty cell.
+    char_masks = dict((c, 0) for c in '0.-')
+    char_masks.update((str(d + 1), 1 << d) for d in range(9))
+
+    last_row_in_box = last_col_in_box = (2, 5)
 
     def __init__(self, cells=None):
         """
         Constructor for Sudoku.  Accepts a string representing a sudoku board.
         """
 
-        # Create lists of sets for all columns, rows, and boxes.
-        self.col_list = [set(cross(self.rows, c)) for c in self.cols]
-        self.row_list = [set(cross(r, self.cols)) for r in self.rows]
-        self.box_list = [set(cross(rs, cs)) for rs in self.row_triplets
-                                            for cs in self.col_triplets]
-
-        # It's useful to have a list of all unit sets.
-        self.unit_list = self.col_list + self.row_list + self.box_list
-
-        # Compile a set of all units for each given square.
-        self.units = dict((s, [u for u in self.unit_list if s in u])
-                      for s in self.squares)
-
-        # Compile a set of all peers for each given square.
+        # Keep track of every square which hasn't been solved yet, as an
+        # 81-bit board bitmask.
         # *** IMPORTANT NOTE *** IMPORTANT NOTE *** IMPORTANT NOTE ***
-        # NOTE: Once a square is removed from self.peers, it is considered
+        # NOTE: Once a square is removed from self.unsolved, it is considered
         # "INKED".  That value is "set" and can will not be altered, or
         # searched on.
         # *** IMPORTANT NOTE *** IMPORTANT NOTE *** IMPORTANT NOTE ***
-        self.peers = dict((s, set(s2 for u in self.units[s]
-                                     for s2 in u if s2 != s)) for
-                          s in self.squares)
+        self.unsolved = (1 << len(_SQUARES)) - 1
 
         # To start, every square can be any digit.
-        self.cells = dict((s, set(self.digits)) for s in self.squares)
+        self.cells = array.array('H', [self.digits] * len(_SQUARES))
+
+        # Work left behind by eliminations: squares which may have been
+        # narrowed down to a single value, and units (indexes into
+        # _UNIT_LIST) which may now hold a hidden singleton.
+        self._singleton_queue = deque()
+        self._unit_dirty = set(range(len(_UNIT_LIST)))
+
+        # The unsolved squares of each unit, kept up to date by self.assign
+        # so the solving steps don't have to rebuild them on every pass.
+        self._unit_squares = [tuple(unit) for unit in _UNIT_LIST]
 
         # Parse the cells if one was passed in.
         if not cells is None:
@@ -87,30 +426,30 @@ class Sudoku(object):
     def parse_cells(self, cells):
         """Parse a string of 81 values into self.cells."""
 
-        # Read in the cells from the string.
-        cells = filter(self.valid_chars.__contains__, cells)
-        cells = map(int, re.sub(r'\D', '0', cells))
+        # Read in the cells from the string, in a single pass.
+        masks = [self.char_masks[c] for c in cells if c in self.char_masks]
 
         # Put each value into the cells.
-        for square, value in zip(sorted(self.squares), cells):
-            if value in self.digits:
-                self.assign(square, value)
+        for square, mask in zip(_SQUARES, masks):
+            if mask:
+                self.assign(square, mask)
 
     def __str__(self):
         """An ascii representation of the Sudoku."""
 
         # All cells will be of the same width.
-        width = 1 + max(len(self.cells[s]) for s in self.squares)
+        strs = [_MASK_STRS[cell] for cell in self.cells]
+        width = 1 + max(len(s) for s in strs)
+        separator = '+'.join(['-' * (width * 3)] * 3)
 
         # Compile all lines into lines.
         lines = []
-        for r in self.rows:
+        for r in range(9):
 
             # Compile all columns into line.
             line = []
-            for c in self.cols:
-                line.append(''.join(map(str,
-                    sorted(self.cells[r + c]))).center(width))
+            for c in range(9):
+                line.append(strs[r * 9 + c].center(width))
 
                 # If this is the end of the box, add a box separator.
                 if c in self.last_col_in_box:
@@ -120,50 +459,99 @@ class Sudoku(object):
 
             # If this is the end of a box, add a box separator.
             if r in self.last_row_in_box:
-                lines.append('+'.join(['-' * (width * 3)] * 3))
+                lines.append(separator)
 
         return '\n'.join(lines)
 
+    def __deepcopy__(self, memo):
+        """
+        Copy only the puzzle's own state.  The units, peers and other
+        lookup tables are module-level and immutable, so they're shared.
+        """
+        new = self.__class__.__new__(self.__class__)
+        memo[id(self)] = new
+
+        new.unsolved = self.unsolved
+        new.cells = self.cells[:]
+        new._singleton_queue = deque(self._singleton_queue)
+        new._unit_dirty = set(self._unit_dirty)
+        new._unit_squares = list(self._unit_squares)
+        return new
+
     # Now for the "solving logic steps".
     ####################################
 
-    def assign(self, square, value):
-        """Set a square's value and eliminate that value from all peers."""
+    def assign(self, square, mask):
+        """
+        Set a square's value (a single-digit bitmask) and eliminate that
+        value from all peers.
+        """
 
         # Check if the value is valid in the square.
-        if value not in self.cells[square]:
-            raise InvalidCellValue("%s can't contain %s." % (square, value))
+        if not self.cells[square] & mask:
+            raise InvalidCellValue("%s can't contain %s." %
+                                   (square, mask_to_str(mask)))
 
         # Set the value
-        self.cells[square] = set((value,))
+        self.cells[square] = mask
+
+        # The square is now inked.
+        self.unsolved &= ~(1 << square)
+        for u in _UNITS[square]:
+            self._unit_squares[u] = tuple(
+                squares_of(self.unsolved & _UNIT_MASKS[u]))
+
+        # The square's other values are gone, so its units need a recheck.
+        self._unit_dirty.update(_UNITS[square])
+
+        # Eliminate value from all of square's unsolved peers.  This is the
+        # hottest loop in the solver, so self.eliminate is inlined here.
+        cells, unsolved = self.cells, self.unsolved
+        notmask = ~mask
+        for peer in _PEERS_LIST[square]:
+            cell = cells[peer]
+            if cell & mask and unsolved >> peer & 1:
+                cell &= notmask
+                if not cell:
+                    raise InvalidCellValue("%s has no values left." % peer)
+                cells[peer] = cell
+
+                if not cell & (cell - 1):
+                    self._singleton_queue.append(peer)
+                self._unit_dirty.update(_UNITS[peer])
+
+    def eliminate(self, square, mask):
+        """
+        Remove the values in mask from a square, queueing up the square and
+        its units to be rechecked.  Returns whether anything was removed.
+        """
+        cell = self.cells[square]
+        if not cell & mask:
+            return False
 
-        # Eliminate value from all of square's peers
-        for peer in self.peers[square]:
-            self.cells[peer].discard(value)
+        cell &= ~mask
+        if not cell:
+            raise InvalidCellValue("%s has no values left." % square)
+        self.cells[square] = cell
 
-        # Clean up square from the remaining data.
-        # It's no longer needed.
-        del self.peers[square]
-        del self.units[square]
-        for peer in self.peers.values():
-            peer.discard(square)
-        for unit in self.unit_list:
-            unit.discard(square)
+        if not cell & (cell - 1):
+            self._singleton_queue.append(square)
+        self._unit_dirty.update(_UNITS[square])
+        return True
 
     def solve_logic(self):
-        """Run through each test, searching for new data."""
-        while self.peers:
+        """
+        Run through each test, searching for new data.
+        Raises InvalidCellValue if a contradiction turns up.
+        """
+        while self.unsolved:
             if self.find_singletons():
                 continue
             if self.hidden_singleton():
                 continue
-            if self.find_hidden_or_naked(2):
-                continue
-            if self.find_hidden_or_naked(3):
-                continue
-            if self.find_hidden_or_naked(4):
+            if self.find_intersections():
                 continue
-            if self.find_hidden_or_naked(5):
+            if self.find_hidden_or_naked():
                 continue
             return False
         return True
@@ -172,9 +560,12 @@ class Sudoku(object):
         """
         Look for un-decided cells which only contain a single possible value.
         """
-        for square in self.peers.keys():
-            if 1 == len(self.cells[square]):
-                self.assign(square, self.cells[square].copy().pop())
+        # Only squares narrowed down by an elimination need checking.
+        while self._singleton_queue:
+            square = self._singleton_queue.popleft()
+            cell = self.cells[square]
+            if self.unsolved >> square & 1 and cell and not cell & (cell - 1):
+                self.assign(square, cell)
                 return True
         return False
 
@@ -186,94 +577,159 @@ class Sudoku(object):
         # NOTE: This function really is a special sub-set of
         # self.find_hidden_naked where count=1
         # But this is most likely more efficient.
-        for digit in self.digits:
-            for unit in self.unit_list:
-                valid_squares = [s for s in unit if digit in self.cells[s]]
-                if 1 == len(valid_squares):
-                    self.assign(valid_squares[0], digit)
+        # Only units touched by an elimination need checking.
+        while self._unit_dirty:
+            unit = self._unit_squares[self._unit_dirty.pop()]
+
+            # Count all 9 values at once, one bit lane per value: which
+            # values appear at least once, and which appear more than once.
+            once = twice = 0
+            for square in unit:
+                twice |= once & self.cells[square]
+                once |= self.cells[square]
+            singles = once & ~twice
+
+            for square in unit:
+                value = self.cells[square] & singles
+                if value:
+                    if value & (value - 1):
+                        raise InvalidCellValue("%s must hold %s." %
+                                               (square, mask_to_str(value)))
+                    self.assign(square, value)
                     return True
         return False
 
-    def find_hidden_or_naked(self, count):
+    def find_intersections(self):
+        """
+        Look for values which, within a box, only appear along one row or
+        column (pointing pairs/triplets), and remove them from the rest of
+        that row or column.  Likewise, look for values which, within a row or
+        column, only appear in one box, and remove them from the rest of that
+        box.
+        """
+        success = False
+        cells = self.cells
+
+        for overlap, box_rest, line_rest in _INTERSECTIONS:
+
+            # Determine which values are present in each part.
+            values = box_values = line_values = 0
+            for square in overlap:
+                values |= cells[square]
+            for square in box_rest:
+                box_values |= cells[square]
+            for square in line_rest:
+                line_values |= cells[square]
+
+            # Values the rest of the box lacks must be in the overlap, so the
+            # rest of the line can't have them, and vice versa.
+            pointing = values & ~box_values
+            claiming = values & ~line_values
+
+            if pointing:
+                for square in line_rest:
+                    if self.unsolved >> square & 1:
+                        success |= self.eliminate(square, pointing)
+            if claiming:
+                for square in box_rest:
+                    if self.unsolved >> square & 1:
+                        success |= self.eliminate(square, claiming)
+
+        return success
+
+    def find_hidden_or_naked(self):
         """
         Look for hidden pairs, triplets, quads, ...
         Look for naked: pairs, triplets, quads, ...
-        This also covers intersection removal.
+        Only groups whose squares (or digits) share identical candidates are
+        found; anything subtler is left to solve_guess_n_check.
         """
         success = False
 
         # Begin by running through each unit.
-        for unit in self.unit_list:
+        for unit in self._unit_squares:
 
-            # Naked triplets in a unit that only has 2 squares is impossible.
-            if len(unit) <= count:
+            # A unit with 2 or fewer squares can't hold a useful group.
+            if len(unit) <= 2:
                 continue
 
-            # Check each combination of cursor squares in the unit.
-            for cursors in map(set, combinations(unit, count)):
-                success |= self.check_hidden(cursors, unit)
-                success |= self.check_naked(cursors)
+            # Make a single pass over the unit, for both checks: bucket the
+            # squares by the values present in them, and determine a bitmap of
+            # the squares (by position within the unit) each value is in.
+            groups = {}
+            positions = {}
+            for i, square in enumerate(unit):
+                cell = self.cells[square]
+                groups.setdefault(cell, []).append(square)
+                for value in bits(cell):
+                    positions[value] = positions.get(value, 0) | (1 << i)
+
+            success |= self.check_hidden(unit, positions)
+            success |= self.check_naked(unit, groups)
 
         return success
 
-    def check_hidden(self, cursors, unit):
-        """Checks to see if cursors contains hidden pairs, or triplets, or..."""
+    def check_hidden(self, unit, positions):
+        """
+        Checks to see if unit contains hidden pairs, or triplets, or...
+        positions maps each value to a bitmap of the squares it's present in.
+        """
         success = False
 
-        # Determine which values are present in cursors.
-        values = set()
-        for square in cursors:
-            values |= self.cells[square]
+        # Bucket the values by the squares they're present in.
+        groups = {}
+        for value, where in positions.items():
+            groups[where] = groups.get(where, 0) | value
 
-        # Keep track of those values, for later comparison.
-        old_values = values.copy()
+        # If no two values share their squares, the only groups are hidden
+        # singletons, which are left to self.hidden_singleton.
+        if len(groups) == len(positions):
+            return False
 
-        # Remove the values from all other squares within the unit.
-        for square in unit - cursors:
-            values -= self.cells[square]
+        for where, values in groups.items():
 
-        # If there are the same number of values as there are cursors,
-        # the group is a hidden group.
-        if len(values) == len(cursors):
+            # If there are the same number of values as there are squares,
+            # the group is a hidden group.
+            count = popcount(where)
+            if count != popcount(values) or count >= len(unit):
+                continue
 
-            # If old_values is the same as values, it's still a hidden set, but
-            # there's no new data gained.  Therefore, there would be no
-            # success.
-            success |= old_values != values
-
-            # Clear the non-hidden values away from each cursor.
-            for square in cursors:
-                self.cells[square] &= values
+            # Clear the non-hidden values away from each square.
+            for i, square in enumerate(unit):
+                if where & (1 << i):
+                    success |= self.eliminate(square, self.digits & ~values)
 
         return success
 
-    def check_naked(self, cursors):
-        """Checks to see if cursors contains naked pairs, or triplets, or..."""
+    def check_naked(self, unit, groups):
+        """
+        Checks to see if unit contains naked pairs, or triplets, or...
+        groups maps the values present in squares to a list of those squares.
+        """
         success = False
 
-        # Determine which values are present in cursors.
-        values = set()
-        for square in cursors:
-            values |= self.cells[square]
+        # If no two squares share their values, the only groups are naked
+        # singletons, which are left to self.find_singletons.
+        if len(groups) == len(unit):
+            return False
+
+        for values, cursors in groups.items():
 
-        # If there the same number of values as there are cursors,
-        # the group is a naked group.
-        if len(values) == len(cursors):
+            # If there the same number of values as there are cursors,
+            # the group is a naked group.
+            if popcount(values) != len(cursors) or len(cursors) >= len(unit):
+                continue
 
             # Find all common peers between the cursors.
-            valid_peers = set(self.squares)
+            valid_peers = self.unsolved
             for square in cursors:
-                valid_peers &= self.peers[square]
+                if not valid_peers:
+                    break
+                valid_peers &= _PEER_MASKS[square]
 
-            # Keep track of all values within those common peers.
-            base = set()
-            for peer in valid_peers - cursors:
-                base |= self.cells[peer]
-                self.cells[peer] -= values
-
-            # If there are common elements between values and the common peers,
-            # some changes were made.
-            success |= bool(base & values)
+            # Remove the values from those common peers.
+            for peer in squares_of(valid_peers):
+                success |= self.eliminate(peer, values)
 
         return success
 
@@ -285,42 +741,61 @@ class Sudoku(object):
         """
 
         # Might as well start with as much knowledge as possible.
-        if self.solve_logic():
-            return True
-
-        # Select a random non-determined square.
-        # There MUST be a better way to do this.
-        square = self.peers.iterkeys().next()
-
-        for value in self.cells[square]:
-
-            # Create a working copy of self.
-            sample = copy.deepcopy(self)
-
-            # Guess and check.  First guess, ...
-            sample.assign(square, value)
-
-            try:
-                # ... then check.
-                if sample.solve_guess_n_check():
+        try:
+            if self.solve_logic():
+                return True
+        except InvalidCellValue:
+            return False
 
-                    # Copy the completely determined cells from the copy.
-                    self.cells = sample.cells
+        # Hand the search off to a compiled kernel, when there is one.  The
+        # C extension (built from _sudoku_c.pyx) works on self.cells directly.
+        if _c_solve is not None:
+            if not _c_solve(self.cells):
+                return False
+            self.unsolved = 0
+            return True
 
-                    # Clean up self's internal data structures.
-                    self.solve_logic()
+        if _solve is not None:
+            cells = numpy.array(self.cells, dtype=numpy.uint16)
+            if not _solve(cells, _PEERS_ARR, _UNITS_ARR, _POPCOUNTS_ARR):
+                return False
+            self.cells[:] = array.array('H', cells.tolist())
+            self.unsolved = 0
+            return True
 
-                    # Clearly this succeeded.
-                    return True
+        # Otherwise, search for the rest as an exact cover problem.
+        return self.solve_exact_cover()
 
-            # If there was a contradiction,
-            except InvalidCellValue:
-                # There's no need to remove the bad value from the cell.
-                # all values will be cycled through, and success will
-                # either be found, or the sudoku puzzle is invalid.
-                continue
+    def solve_exact_cover(self):
+        """
+        Solve the remaining squares with dancing links, where each possible
+        value of each square is a row of the exact cover matrix.
+        """
+        links = DancingLinks(_COVER_COLUMN_COUNT)
+
+        # Add a row for every value still possible in each square.
+        inked = []
+        for square, cell in enumerate(self.cells):
+            for value in bits(cell):
+                row = square * 9 + value.bit_length() - 1
+                node = links.add_row(row, _COVER_COLUMNS[row])
+                if not self.unsolved >> square & 1:
+                    inked.append(node)
+
+        # Inked squares are already part of the solution.
+        for node in inked:
+            links.select(node)
+
+        solution = []
+        if not links.search(solution):
+            return False
 
-        return False
+        # Fill in the solved squares.
+        for row in solution:
+            square, digit = divmod(row, 9)
+            self.cells[square] = 1 << digit
+        self.unsolved = 0
+        return True
 
 
 if __name__ == '__main__':
@@ -416,16 +891,16 @@ if __name__ == '__main__':
 
     for sample_grid in sample_grids:
         sudoku = Sudoku(sample_grid)
-        #print sudoku
-        print
+        #print(sudoku)
+        print()
         sudoku.solve_logic()
-        print sudoku
-        print
+        print(sudoku)
+        print()
         sudoku.solve_guess_n_check()
-        print sudoku
-        print
-        print 'pdbq' * 20
-        print
+        print(sudoku)
+        print()
+        print('pdbq' * 20)
+        print()
 
     # The idea is to add more logic such that the solve_brute_force is never
     # necessary.